@@ -36,6 +36,7 @@ setup(
     package_data={'': ["template/*"]},
     include_package_data=True,
     install_requires=requirements,
+    python_requires='>=3.7',
     license='MIT',
     zip_safe=False,
     classifiers=[
@@ -45,7 +46,6 @@ setup(
         'Natural Language :: English',
         'License :: OSI Approved :: MIT License',
         'Programming Language :: Python',
-        'Programming Language :: Python :: 2',
         'Programming Language :: Python :: 3',
         'Topic :: Software Development',
     ],
@@ -1,26 +1,39 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, print_function
 
-import sys, os
+import os
+import itertools
+import threading
 import hashlib
-import base64
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
 from datetime import datetime, timedelta
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError
+from urllib3.util.retry import Retry
 from github import Github, UnknownObjectException, GithubException
+from github.Consts import DEFAULT_TIMEOUT
+from github.Requester import Requester, HTTPRequestsConnectionClass, HTTPSRequestsConnectionClass
+try:
+    from github.GithubRetry import GithubRetry
+except ImportError:  # pragma: no cover
+    GithubRetry = None
 import click
-from jinja2 import Template
+from jinja2 import Environment, FunctionLoader, FileSystemBytecodeCache
 from tqdm import tqdm
-from collections import OrderedDict
+from collections import namedtuple
 import markdown2
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
 import json
 
 __version__ = "1.0"
 
 ROOT = os.path.dirname(os.path.realpath(__file__))
 
-PY3 = sys.version_info >= (3, 0)
-
 DEFAULT_CONFIG = {
     "footer": "Status page hosted by GitHub, generated with <a href='https://github.com/jayfk/statuspage'>jayfk/statuspage</a>",
     "logo": "https://raw.githubusercontent.com/jayfk/statuspage/master/template/logo.png",
@@ -40,6 +53,169 @@ DEFAULT_CONFIG = {
     ]
 }
 
+# pooled sessions shared by all GitHub API calls, so that consecutive requests reuse the same
+# TCP/TLS connection instead of doing a fresh handshake every time. Keyed by retry configuration
+_SESSIONS = {}
+_SESSION_LOCK = threading.Lock()
+
+# used if PyGithub doesn't pass a retry configuration of its own. Newer PyGithub versions ship
+# a retry that also handles secondary rate limits
+if GithubRetry is not None:
+    DEFAULT_RETRY = GithubRetry()
+else:  # pragma: no cover
+    DEFAULT_RETRY = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+
+
+def json_dumps(obj):
+    """
+    Serializes obj to pretty printed, UTF-8 encoded JSON. Uses orjson if it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS)
+    return json.dumps(obj, indent=2, sort_keys=True, ensure_ascii=False).encode("utf-8")
+
+
+def json_loads(s):
+    """
+    Parses a JSON str or bytes object. Uses orjson if it is installed.
+    """
+    if orjson is not None:
+        return orjson.loads(s)
+    return json.loads(s)
+
+
+GITHUB_GRAPHQL_URL = "https://api.github.com/graphql"
+
+GITHUB_DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+ISSUES_QUERY = """
+query($owner: String!, $name: String!, $since: DateTime!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    issues(first: 100, after: $cursor, filterBy: {since: $since}) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        number title body state createdAt updatedAt
+        author { login }
+        labels(first: 100) { nodes { name color } }
+        comments(first: 100) {
+          pageInfo { hasNextPage endCursor }
+          nodes { body createdAt author { login } }
+        }
+      }
+    }
+  }
+}
+"""
+
+COMMENTS_QUERY = """
+query($owner: String!, $name: String!, $number: Int!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    issue(number: $number) {
+      comments(first: 100, after: $cursor) {
+        pageInfo { hasNextPage endCursor }
+        nodes { body createdAt author { login } }
+      }
+    }
+  }
+}
+"""
+
+# issues as returned by the GraphQL API, see get_issues
+Issue = namedtuple(
+    "Issue",
+    ["number", "title", "body", "state", "created_at", "updated_at", "author", "labels", "comments"]
+)
+
+# the index commit message records the data the index was rendered from, see is_outdated
+CONTENT_TRAILER = "Statuspage-Content: "
+Label = namedtuple("Label", ["name", "color"])
+Comment = namedtuple("Comment", ["body", "created_at", "author"])
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "statuspage")
+
+# rendered issue bodies and comments, keyed by the hash of their markdown
+MARKDOWN_CACHE_PATH = os.path.join(CACHE_DIR, "markdown.json")
+MARKDOWN_CACHE_SIZE = 4096
+
+# sources of the templates fetched from the repo, keyed by their git SHA. Compiled templates are
+# cached by the environment, their bytecode is cached on disk in between runs. A SHA always
+# refers to the same source, so there is no need to check cached templates for changes.
+# Autoescaping stays off, templates render HTML from the config and the issues as is
+_TEMPLATE_SOURCES = {}
+JINJA_ENV = Environment(
+    loader=FunctionLoader(_TEMPLATE_SOURCES.get),
+    bytecode_cache=FileSystemBytecodeCache(pattern="statuspage_%s.cache"),
+    auto_reload=False,
+    autoescape=False
+)
+
+# number of concurrent GitHub API calls, must not exceed the pool size above
+MAX_WORKERS = 8
+
+# Github clients, keyed by token
+_GITHUB_CLIENTS = {}
+
+# round-robin iterators over all tokens of a comma separated --token option, keyed by the first
+# token. Requests are made with the first token, reads of the repo are switched to the next one
+# in line
+_TOKEN_CYCLES = {}
+_TOKEN_LOCK = threading.Lock()
+
+
+class PooledHTTPSConnection(HTTPSRequestsConnectionClass):
+    """
+    PyGithub connection class that sends all requests through the shared session.
+    """
+
+    def __init__(self, host, port=None, strict=False, timeout=None, **kwargs):
+        self.port = port if port else 443
+        self.host = host
+        self.protocol = "https"
+        self.timeout = timeout
+        self.verify = kwargs.get("verify", True)
+        self.session = get_session(kwargs.get("retry"))
+
+    def getresponse(self):
+        # rate limits are per account, so only reads of the repo are spread over all tokens.
+        # Everything else, like resolving the authenticated user or committing, is done with the
+        # first token so that it always refers to the same account
+        scheme, _, token = self.headers.get("Authorization", "").partition(" ")
+        if token in _TOKEN_CYCLES and self.verb == "GET" and self.url.startswith("/repos/"):
+            self.headers["Authorization"] = scheme + " " + next_token(token)
+        return super(PooledHTTPSConnection, self).getresponse()
+
+    def close(self):
+        # the session is shared, keep its connections open
+        pass
+
+
+Requester.injectConnectionClasses(HTTPRequestsConnectionClass, PooledHTTPSConnection)
+
+
+def get_session(retry=None):
+    """
+    Returns the pooled session for the given retry configuration.
+    """
+    if retry is None:
+        retry = DEFAULT_RETRY
+    with _SESSION_LOCK:
+        if retry not in _SESSIONS:
+            session = requests.Session()
+            # the token is sent in the Authorization header, don't let requests replace it with
+            # credentials from ~/.netrc
+            session.auth = no_auth
+            session.mount("https://", HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=16,
+                max_retries=retry
+            ))
+            _SESSIONS[retry] = session
+        return _SESSIONS[retry]
+
+
+def no_auth(request):
+    return request
+
 @click.group()
 @click.version_option(__version__, '-v', '--version')
 def cli():  # pragma: no cover
@@ -53,7 +229,7 @@ def config_init():
 
 @cli.command()
 @click.option('--name', prompt='Name', help='')
-@click.option('--token', prompt='GitHub API Token', help='')
+@click.option('--token', prompt='GitHub API Token', help='GitHub API Token, separate multiple tokens with commas')
 @click.option('--org', help='GitHub Organization', default=False)
 @click.option('--systems', prompt='Systems, eg (Website,API)', help='')
 @click.option('--private/--public', default=False)
@@ -67,16 +243,17 @@ def create(token, name, systems, org, private, config, branch_main, branch_pages
 @cli.command()
 @click.option('--name', prompt='Name', help='')
 @click.option('--org', help='GitHub Organization', default=False)
-@click.option('--token', prompt='GitHub API Token', help='')
+@click.option('--token', prompt='GitHub API Token', help='GitHub API Token, separate multiple tokens with commas')
 @click.option('--branch-pages', help='GitHub pages branch', default='gh-pages')
-def update(name, token, org, branch_pages):
-    run_update(name=name, token=token, org=org, branch_pages=branch_pages)
+@click.option('--force', is_flag=True, help='Re-generate the page even if nothing changed')
+def update(name, token, org, branch_pages, force):
+    run_update(name=name, token=token, org=org, branch_pages=branch_pages, force=force)
 
 
 @cli.command()
 @click.option('--name', prompt='Name', help='')
 @click.option('--org', help='GitHub Organization', default=False)
-@click.option('--token', prompt='GitHub API Token', help='')
+@click.option('--token', prompt='GitHub API Token', help='GitHub API Token, separate multiple tokens with commas')
 @click.option('--branch-pages', help='GitHub pages branch', default='gh-pages')
 def upgrade(name, token, org, branch_pages):
     run_upgrade(name=name, token=token, org=org, branch_pages=branch_pages)
@@ -85,7 +262,7 @@ def upgrade(name, token, org, branch_pages):
 @cli.command()
 @click.option('--name', prompt='Name', help='')
 @click.option('--org', help='GitHub Organization', default=False)
-@click.option('--token', prompt='GitHub API Token', help='')
+@click.option('--token', prompt='GitHub API Token', help='GitHub API Token, separate multiple tokens with commas')
 @click.option('--system', prompt='System', help='System to add')
 @click.option('--prompt/--no-prompt', default=True)
 @click.option('--branch-pages', help='GitHub pages branch', default='gh-pages')
@@ -96,7 +273,7 @@ def add_system(name, token, org, system, prompt, branch_pages):
 @cli.command()
 @click.option('--name', prompt='Name', help='')
 @click.option('--org', help='GitHub Organization', default=False)
-@click.option('--token', prompt='GitHub API Token', help='')
+@click.option('--token', prompt='GitHub API Token', help='GitHub API Token, separate multiple tokens with commas')
 @click.option('--system', prompt='System', help='System to remove')
 @click.option('--prompt/--no-prompt', default=True)
 @click.option('--branch-pages', help='GitHub pages branch', default='gh-pages')
@@ -108,20 +285,18 @@ def init_default_config():
     """
     Touches a new config file in the current path
     """
-    f = open("config.json", "w")
-    f.write(json.dumps(DEFAULT_CONFIG, indent=4, sort_keys=True))
-    f.close()
+    with open("config.json", "wb") as f:
+        f.write(json_dumps(DEFAULT_CONFIG))
     click.secho("Successfully created new config", fg="green")
 
 def read_local_config(path):
     """
     Reads in a JSON config file from the given path
     """
-    if os.path.isfile(path):
-        f = open("config.json", "r", encoding='utf-8')
-        return json.loads(f.read())
-    else:
-        raise
+    if not os.path.isfile(path):
+        raise click.FileError(path, hint="Config file does not exist.")
+    with open(path, "rb") as f:
+        return json_loads(f.read())
 
 def run_add_system(name, token, org, system, prompt, branch_pages):
     """
@@ -133,7 +308,7 @@ def run_add_system(name, token, org, system, prompt, branch_pages):
         repo.create_label(name=system.strip(), color=config['system-color'])
         click.secho("Successfully added new system {}".format(system), fg="green")
         if prompt and click.confirm("Run update to re-generate the page?"):
-            run_update(name=name, token=token, org=org, branch_pages=branch_pages)
+            run_update(name=name, token=token, org=org, branch_pages=branch_pages, force=True)
     except GithubException as e:
         if e.status == 422:
             click.secho(
@@ -152,7 +327,7 @@ def run_remove_system(name, token, org, system, prompt, branch_pages):
         label.delete()
         click.secho("Successfully deleted {}".format(system), fg="green")
         if prompt and click.confirm("Run update to re-generate the page?"):
-            run_update(name=name, token=token, org=org, branch_pages=branch_pages)
+            run_update(name=name, token=token, org=org, branch_pages=branch_pages, force=True)
     except UnknownObjectException:
         click.secho("Unable to remove system {}, it does not exist.".format(system), fg="yellow")
 
@@ -161,96 +336,101 @@ def run_upgrade(name, token, org, branch_pages):
     click.echo("Upgrading...")
 
     repo = get_repo(token=token, name=name, org=org)
-    files = get_files(repo=repo)
-    head_sha = repo.get_git_ref("heads/" + branch_pages).object.sha
+    files = get_files(repo=repo, branch_pages=branch_pages)
 
-    # add all the template files to the gh-pages branch
-    for template in tqdm(DEFAULT_CONFIG['templates'], desc="Updating template files"):
-        with open(os.path.join(ROOT, "template", template), "r", encoding='utf-8') as f:
-            content = f.read()
-            if template in files:
-                repo_template = repo.get_contents(
-                    path="/" + template,
-                    ref=head_sha,
-                )
-                if not is_same_content(
-                    content,
-                    base64.b64decode(repo_template.content)
-                ):
-                    repo.update_file(
-                        path=template,
-                        sha=repo_template.sha,
-                        message="upgrade",
-                        content=content,
-                        branch=branch_pages
-                    )
-            else:
-                repo.create_file(
-                    path=template,
-                    message="upgrade",
-                    content=content,
-                    branch=branch_pages
-                )
-
-
-def run_update(name, token, org, branch_pages):
+    # compare the git blob SHAs of the local templates with the ones in the listing, this
+    # way only templates that actually changed have to be touched
+    templates = DEFAULT_CONFIG['templates']
+    changes = [get_template_change(template, files=files) for template in templates]
+
+    # add all the changed template files to the gh-pages branch
+    for template, change in tqdm(list(zip(templates, changes)), desc="Updating template files"):
+        if change is None:
+            continue
+        content, sha = change
+        if sha is not None:
+            repo.update_file(
+                path=template,
+                sha=sha,
+                message="upgrade",
+                content=content,
+                branch=branch_pages
+            )
+        else:
+            repo.create_file(
+                path=template,
+                message="upgrade",
+                content=content,
+                branch=branch_pages
+            )
+
+
+def run_update(name, token, org, branch_pages, force=False):
     click.echo("Generating..")
     repo = get_repo(token=token, name=name, org=org)
-    issues = get_issues(repo)
+
+    # the labels, collaborators and issues are independent of each other, fetch them concurrently
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        labels = executor.submit(list, repo.get_labels())
+        collaborators = executor.submit(get_collaborators, repo=repo)
+        issues = executor.submit(get_issues, token=token, repo=repo)
+        files = get_files(repo, branch_pages)
+        labels, collaborators, issues = labels.result(), collaborators.result(), issues.result()
 
     # get the SHA of the current HEAD
     sha = repo.get_git_ref("heads/" + branch_pages).object.sha
 
-    # get the template from the repo
-    template_file = repo.get_contents(
-        path="/template.html",
-        ref=sha
-    )
+    # check if the custom config exists, default back to defaults if it does not
+    config = get_config(repo, branch_pages, files=files)
 
-    # check if the custom config exists, default back to defaults if it does not 
-    config = get_config(repo, branch_pages)
+    # only the names of the status labels are needed to look up the severity of an issue
+    status_labels = frozenset(config['status-labels'])
+
+    systems, panels = get_systems(labels, issues, config['system-color'], status_labels)
+    markdown_cache = read_markdown_cache()
+    incidents = get_incidents(
+        issues, collaborators, config['system-color'], status_labels, markdown_cache=markdown_cache
+    )
+    write_markdown_cache(markdown_cache)
 
-    systems = get_systems(repo, issues, config['system-color'], config['status-labels'])
-    incidents = get_incidents(repo, issues, config['system-color'], config['status-labels'])
-    panels = get_panels(systems)
+    content_hash = get_content_hash(systems, panels, incidents)
+    if not force and not is_outdated(repo, sha, content_hash):
+        click.echo("No changes since the last update, no need to commit.")
+        return False
 
     # render the template
-    template = Template(template_file.decoded_content.decode("utf-8"))
+    template = get_template(repo, files["template.html"], ref=sha)
     content = template.render({
         "systems": systems, "incidents": incidents, "panels": panels, "config": config
     })
 
-    # create/update the index.html with the template
-    try:
-        # get the index.html file, we need the sha to update it
-        index = repo.get_contents(
-            path="/index.html",
-            ref=sha,
-        )
-
-        if is_same_content(content, base64.b64decode(index.content)):
+    # create/update the index.html with the template. The listing has the blob SHA of the current
+    # index, there is no need to download it for the comparison
+    trailer = "\n\n" + CONTENT_TRAILER + content_hash
+    if "index.html" in files:
+        if files["index.html"] == git_blob_sha(content):
             click.echo("Local status matches remote status, no need to commit.")
             return False
 
         repo.update_file(
             path="index.html",
-            sha=index.sha,
-            message="update index",
+            sha=files["index.html"],
+            message="update index" + trailer,
             content=content,
             branch="gh-pages"
         )
-    except UnknownObjectException:
+    else:
         # index.html does not exist, create it
         repo.create_file(
             path="index.html",
-            message="initial",
+            message="initial" + trailer,
             content=content,
             branch="gh-pages",
         )
 
 
 def run_create(name, token, systems, org, private, config_path, branch_main, branch_pages):
-    gh = Github(token)
+    gh = get_github(token)
     config = read_local_config(config_path) if config_path else DEFAULT_CONFIG
 
     if org:
@@ -292,19 +472,18 @@ def run_create(name, token, systems, org, private, config_path, branch_main, bra
 
     # add all the template files to the gh-pages branch
     for template in tqdm(config['templates'], desc="Adding template files"):
-        with open(os.path.join(ROOT, "template", template), "r", encoding='utf-8') as f:
-            repo.create_file(
-                path=template,
-                message="initial",
-                content=f.read(),
-                branch=branch_pages
-            )
+        repo.create_file(
+            path=template,
+            message="initial",
+            content=read_template(template),
+            branch=branch_pages
+        )
 
     # create an initial config.json file
     repo.create_file(
         path='config.json',
         message="initial",
-        content=json.dumps(config, indent=4, sort_keys=True),
+        content=json_dumps(config),
         branch=branch_pages
     )
 
@@ -338,25 +517,71 @@ def iter_systems(labels, system_color):
             yield label.name
 
 
-def get_files(repo):
+def read_template(template):
+    """
+    Reads the local copy of the given template file.
+    """
+    with open(os.path.join(ROOT, "template", template), "r", encoding='utf-8') as f:
+        return f.read()
+
+
+def get_template_change(template, files):
+    """
+    Compares the local template with the one in the repo. Returns None if both are the same,
+    otherwise a (content, sha) tuple where sha is None if the template is not in the repo yet.
+    """
+    content = read_template(template)
+    if template not in files:
+        return content, None
+    if files[template] == git_blob_sha(content):
+        return None
+    return content, files[template]
+
+
+def git_blob_sha(content):
+    """
+    Returns the SHA git (and GitHub) uses for a blob with the given content.
+    """
+    if not isinstance(content, bytes):
+        content = content.encode("utf-8")
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+def get_template(repo, sha, ref):
+    """
+    Returns the compiled jinja template for the template.html with the given blob SHA. The source
+    is only downloaded if it is not in the local cache yet.
+    """
+    if sha not in _TEMPLATE_SOURCES:
+        path = os.path.join(CACHE_DIR, "templates", sha + ".html")
+        source = read_cache_file(path)
+        if source is None or git_blob_sha(source) != sha:
+            source = repo.get_contents(path="/template.html", ref=ref).decoded_content
+            write_cache_file(path, source)
+        _TEMPLATE_SOURCES[sha] = source.decode("utf-8")
+    return JINJA_ENV.get_template(sha)
+
+
+def get_files(repo, branch_pages="gh-pages"):
     """
-    Get a list of all files.
+    Get all files in the root of the pages branch, mapped to their git blob SHA.
     """
-    return [file.path for file in repo.get_contents("/", ref="gh-pages")]
+    return {file.path: file.sha for file in repo.get_contents("/", ref=branch_pages)}
 
 
-def get_config(repo, branch_pages):
+def get_config(repo, branch_pages, files=None):
     """
     Get the config for the repo, merged with the default config. Returns the default config if
-    no config file is found.
+    no config file is found. Pass in the list of files if it is already known to save a request.
     """
-    files = get_files(repo)
+    if files is None:
+        files = get_files(repo, branch_pages)
     config = DEFAULT_CONFIG
     if "config.json" in files:
         # get the config file, parse JSON and merge it with the default config
         config_file = repo.get_contents('config.json', ref=branch_pages)
         try:
-            repo_config = json.loads(config_file.decoded_content.decode("utf-8"))
+            repo_config = json_loads(config_file.decoded_content)
             config.update(repo_config)
         except ValueError:
             click.secho("WARNING: Unable to parse config file. Using defaults.", fg="yellow")
@@ -364,109 +589,304 @@ def get_config(repo, branch_pages):
 
 
 def get_severity(labels, status_labels):
-    for label in labels:
-        if label.name in status_labels:
-            return label.name
-    return None
+    return next((label.name for label in labels if label.name in status_labels), None)
 
 
-def get_panels(systems):
-    # initialize and fill the panels with affected systems
-    panels = OrderedDict()
-    for system, data in systems.items():
-        if data["status"] != "operational":
-            if data["status"] in panels:
-                panels[data["status"]].append(system)
-            else:
-                panels[data["status"]] = [system, ]
-    return panels
+def get_github(token):
+    """
+    Returns a Github client for the given token, reusing a previously created one if possible.
+    """
+    if token not in _GITHUB_CLIENTS:
+        tokens = split_tokens(token)
+        if len(tokens) > 1:
+            _TOKEN_CYCLES[tokens[0]] = itertools.cycle(tokens)
+        _GITHUB_CLIENTS[token] = Github(tokens[0])
+    return _GITHUB_CLIENTS[token]
+
+
+def split_tokens(token):
+    return [t.strip() for t in token.split(",") if t.strip()]
+
+
+def next_token(token):
+    """
+    Returns the token to use for the next request. If multiple comma separated tokens are given,
+    they are used in turn to spread the requests over their rate limits.
+    """
+    first = split_tokens(token)[0]
+    with _TOKEN_LOCK:
+        if first in _TOKEN_CYCLES:
+            return next(_TOKEN_CYCLES[first])
+    return first
 
 
 def get_repo(token, name, org):
-    gh = Github(token)
+    gh = get_github(token)
     if org:
         return gh.get_organization(org).get_repo(name=name)
     return gh.get_user().get_repo(name=name)
 
 
+def is_outdated(repo, head_sha, content_hash):
+    """
+    Checks if the index needs to be re-generated. This is the case if anything else has been
+    committed since the index was last generated, or if the data shown on the page differs from
+    the data the index was rendered from.
+    """
+    try:
+        last_commit = repo.get_commits(sha=head_sha, path="index.html")[0]
+    except IndexError:
+        # there is no index yet
+        return True
+    if last_commit.sha != head_sha:
+        return True
+    return CONTENT_TRAILER + content_hash not in last_commit.commit.message.splitlines()
+
+
+def get_content_hash(systems, panels, incidents):
+    """
+    Returns a hash over the data the page is rendered from.
+    """
+    return hashlib.sha1(repr((systems, panels, incidents)).encode("utf-8")).hexdigest()
+
+
 def get_collaborators(repo):
     return [col.login for col in repo.get_collaborators()]
 
 
-def get_systems(repo, issues, system_color, status_labels):
-    systems = OrderedDict()
+def get_systems(labels, issues, system_color, status_labels):
+    systems = {}
     # get all systems and mark them as operational
-    for name in sorted(iter_systems(repo.get_labels(), system_color)):
+    for name in sorted(iter_systems(labels, system_color)):
         systems[name] = {
             "status": "operational",
         }
 
     for issue in issues:
         if issue.state == "open":
-            labels = issue.get_labels()
-            severity = get_severity(labels, status_labels)
-            affected_systems = list(iter_systems(labels, system_color))
+            severity = get_severity(issue.labels, status_labels)
+            affected_systems = list(iter_systems(issue.labels, system_color))
             # shit is hitting the fan RIGHT NOW. Mark all affected systems
             for affected_system in affected_systems:
                 systems[affected_system]["status"] = severity
-    return systems
 
+    # initialize and fill the panels with affected systems. This is done once all issues are
+    # processed, the last open issue determines the status of a system
+    panels = {}
+    for system, data in systems.items():
+        if data["status"] != "operational":
+            panels.setdefault(data["status"], []).append(system)
+    return systems, panels
 
-def get_incidents(repo, issues, system_color, status_labels):
+
+def get_incidents(issues, collaborators, system_color, status_labels, markdown_cache=None):
     # loop over all issues in the past 90 days to get current and past incidents
     incidents = []
-    collaborators = get_collaborators(repo=repo)
     for issue in issues:
-        labels = issue.get_labels()
-        affected_systems = sorted(iter_systems(labels, system_color))
-        severity = get_severity(labels, status_labels)
+        incident = get_incident(
+            issue, collaborators, system_color, status_labels, markdown_cache=markdown_cache
+        )
+        if incident is not None:
+            incidents.append(incident)
 
-        # make sure that non-labeled issues are not displayed
-        if not affected_systems or (severity is None and issue.state != "closed"):
-            continue
+    # sort incidents by date
+    return sorted(incidents, key=itemgetter("created"), reverse=True)
 
-        # make sure that the user that created the issue is a collaborator
-        if issue.user.login not in collaborators:
-            continue
 
-        # create an incident
-        incident = {
-            "created": issue.created_at,
-            "title": issue.title,
-            "systems": affected_systems,
-            "severity": severity,
-            "closed": issue.state == "closed",
-            "body": markdown2.markdown(issue.body),
-            "updates": []
-        }
+def get_incident(issue, collaborators, system_color, status_labels, markdown_cache=None):
+    """
+    Creates an incident from the given issue. Returns None if the issue should not be displayed.
+    """
+    # most incidents affect a single system, only sort if there is something to sort
+    affected_systems = [label.name for label in issue.labels if label.color == system_color]
+    if len(affected_systems) > 1:
+        affected_systems.sort()
+    severity = get_severity(issue.labels, status_labels)
+
+    # make sure that non-labeled issues are not displayed
+    if not affected_systems or (severity is None and issue.state != "closed"):
+        return None
+
+    # make sure that the user that created the issue is a collaborator
+    if issue.author not in collaborators:
+        return None
+
+    # create an incident
+    incident = {
+        "created": issue.created_at,
+        "title": issue.title,
+        "systems": affected_systems,
+        "severity": severity,
+        "closed": issue.state == "closed",
+        "body": render_markdown(issue.body, cache=markdown_cache),
+        "updates": []
+    }
+
+    for comment in issue.comments:
+        # add comments by collaborators only
+        if comment.author in collaborators:
+            incident["updates"].append({
+                "created": comment.created_at,
+                "body": render_markdown(comment.body, cache=markdown_cache)
+            })
+
+    return incident
+
+
+def render_markdown(text, cache=None):
+    """
+    Renders the given markdown text to HTML. If a cache is given, texts that have been rendered
+    before are looked up by their hash instead.
+    """
+    if cache is None:
+        return markdown2.markdown(text)
+    key = hashlib.sha1((markdown2.__version__ + "\0" + text).encode("utf-8")).hexdigest()
+    if key in cache:
+        # move the entry to the end, the cache is written in least recently used order
+        cache[key] = cache.pop(key)
+    else:
+        cache[key] = markdown2.markdown(text)
+    return cache[key]
 
-        for comment in issue.get_comments():
-            # add comments by collaborators only
-            if comment.user.login in collaborators:
-                incident["updates"].append({
-                    "created": comment.created_at,
-                    "body": markdown2.markdown(comment.body)
-                })
 
-        incidents.append(incident)
+def read_markdown_cache():
+    """
+    Reads the cache of rendered markdown texts. Returns an empty cache if there is none yet.
+    """
+    try:
+        return dict(json_loads(read_cache_file(MARKDOWN_CACHE_PATH) or b"[]"))
+    except (ValueError, TypeError):
+        # not valid JSON or not a list of pairs
+        return {}
 
-    # sort incidents by date
-    return sorted(incidents, key=lambda i: i["created"], reverse=True)
 
+def write_markdown_cache(cache):
+    """
+    Writes the most recently used entries of the markdown cache to disk.
+    """
+    write_cache_file(MARKDOWN_CACHE_PATH, json_dumps(list(cache.items())[-MARKDOWN_CACHE_SIZE:]))
 
-def get_issues(repo):
-    return repo.get_issues(state="all", since=datetime.now() - timedelta(days=90))
 
+def read_cache_file(path):
+    """
+    Reads a file from the local cache. Returns None if it does not exist.
+    """
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
 
-def is_same_content(c1, c2):
-    def sha1(c):
-        if PY3:
-            if isinstance(c, str):
-                c = bytes(c, "utf-8")
-        else:
-            c = c.encode("utf-8")
-        return hashlib.sha1(c)
-    return sha1(c1).hexdigest() == sha1(c2).hexdigest()
+
+def write_cache_file(path, content):
+    """
+    Writes a file to the local cache. Failing to do so only costs some performance, so errors
+    are not fatal.
+    """
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as f:
+            f.write(content)
+    except (IOError, OSError):
+        click.secho("WARNING: Unable to write cache file {}.".format(path), fg="yellow")
+
+
+def graphql(token, query, **variables):
+    """
+    Runs a query against the GitHub GraphQL API and returns its data.
+    """
+    response = get_session().post(
+        GITHUB_GRAPHQL_URL,
+        json={"query": query, "variables": variables},
+        headers={"Authorization": "bearer " + next_token(token)},
+        timeout=DEFAULT_TIMEOUT
+    )
+    if response.status_code != 200:
+        raise GithubException(response.status_code, response.text)
+    data = json_loads(response.content)
+    if data.get("errors"):
+        raise GithubException(response.status_code, data["errors"])
+    return data["data"]
+
+
+def get_issues(token, repo):
+    """
+    Get all issues updated in the past 90 days along with their labels and comments, with a single
+    GraphQL query per 100 issues.
+    """
+    since = (datetime.utcnow() - timedelta(days=90)).strftime(GITHUB_DATE_FORMAT)
+    nodes = []
+    cursor = None
+    while True:
+        data = graphql(
+            token, ISSUES_QUERY, owner=repo.owner.login, name=repo.name, since=since, cursor=cursor
+        )
+        page = data["repository"]["issues"]
+        nodes += page["nodes"]
+        if not page["pageInfo"]["hasNextPage"]:
+            break
+        cursor = page["pageInfo"]["endCursor"]
+
+    # issues with more than 100 comments need follow-up queries, run them concurrently
+    truncated = [node for node in nodes if node["comments"]["pageInfo"]["hasNextPage"]]
+    if truncated:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            more_comments = executor.map(
+                lambda node: get_more_comments(
+                    token, repo, node["number"], node["comments"]["pageInfo"]["endCursor"]
+                ),
+                truncated
+            )
+            for node, comments in zip(truncated, more_comments):
+                node["comments"]["nodes"] += comments
+
+    return [parse_issue(node) for node in nodes]
+
+
+def parse_issue(node):
+    """
+    Creates an Issue from an issue node of the GraphQL API.
+    """
+    return Issue(
+        number=node["number"],
+        title=node["title"],
+        body=node["body"],
+        state=node["state"].lower(),
+        created_at=parse_github_date(node["createdAt"]),
+        updated_at=parse_github_date(node["updatedAt"]),
+        author=get_login(node["author"]),
+        labels=[Label(name=label["name"], color=label["color"]) for label in node["labels"]["nodes"]],
+        comments=[Comment(
+            body=comment["body"],
+            created_at=parse_github_date(comment["createdAt"]),
+            author=get_login(comment["author"])
+        ) for comment in node["comments"]["nodes"]]
+    )
+
+
+def get_more_comments(token, repo, number, cursor):
+    """
+    Get the comments of an issue that did not fit into the first page of the issues query.
+    """
+    comments = []
+    while cursor is not None:
+        data = graphql(
+            token, COMMENTS_QUERY, owner=repo.owner.login, name=repo.name, number=number, cursor=cursor
+        )
+        page = data["repository"]["issue"]["comments"]
+        comments += page["nodes"]
+        cursor = page["pageInfo"]["endCursor"] if page["pageInfo"]["hasNextPage"] else None
+    return comments
+
+
+def get_login(author):
+    # the author is null if the account has been deleted
+    return author["login"] if author else None
+
+
+def parse_github_date(date):
+    return datetime.strptime(date, GITHUB_DATE_FORMAT)
 
 
 if __name__ == '__main__':  # pragma: no cover
@@ -5,13 +5,18 @@ from datetime import datetime
 from unittest import TestCase
 from mock import patch, Mock
 from click.testing import CliRunner
+import click
 from statuspage import cli, update, upgrade, create, iter_systems, get_severity, DEFAULT_CONFIG
-from github import UnknownObjectException
+import statuspage
+from github import UnknownObjectException, GithubException
 import codecs
+import os
+import tempfile
 
 class CLITestCase(TestCase):
 
     def setUp(self):
+        statuspage._GITHUB_CLIENTS.clear()
         self.patcher = patch('statuspage.Github')
         self.gh = self.patcher.start()
 
@@ -26,27 +31,29 @@ class CLITestCase(TestCase):
 
         self.gh().get_user().get_repo().get_labels.return_value = [self.label, self.label1]
 
-        # set up mocked issue
-        self.issue = Mock()
-        self.issue.created_at = datetime.now()
-        self.issue.state = "open"
-        self.issue_label = Mock()
-        self.issue_label.color = "FF4D4D"
-        self.issue_label.name = "major outage"
-        self.issue.get_labels.return_value = [self.issue_label, self.label]
-        self.issue.user.login = "some-dude"
-        self.comment = Mock()
-        self.comment.user.login = "some-dude"
-        self.issue.get_comments.return_value = [self.comment, ]
-
-        self.issue1 = Mock()
-        self.issue1.created_at = datetime.now()
-        self.issue1.state = "open"
-        self.issue1.user.login = "some-dude"
-        self.issue1.get_labels.return_value = [self.issue_label, self.label1]
-        self.issue1.get_comments.return_value = [self.comment, ]
-
-        self.gh().get_user().get_repo().get_issues.return_value = [self.issue, self.issue1]
+        # set up mocked issues
+        self.issue_label = statuspage.Label(name="major outage", color="FF4D4D")
+        self.comment = statuspage.Comment(body="some update", created_at=datetime.now(), author="some-dude")
+        self.issue = statuspage.Issue(
+            number=1,
+            title="some issue",
+            body="some body",
+            state="open",
+            created_at=datetime.now(),
+            updated_at=datetime.now(),
+            author="some-dude",
+            labels=[self.issue_label, statuspage.Label(name="Website", color="171717")],
+            comments=[self.comment, ]
+        )
+        self.issue1 = self.issue._replace(
+            number=2,
+            labels=[self.issue_label, statuspage.Label(name="API", color="171717")]
+        )
+
+        self.issues_patcher = patch('statuspage.get_issues')
+        self.get_issues = self.issues_patcher.start()
+        self.get_issues.return_value = [self.issue, self.issue1]
+
         self.template = Mock()
         self.template.decoded_content = b"some foo"
         self.template.content = codecs.encode(b"some other foo", "base64")
@@ -62,6 +69,7 @@ class CLITestCase(TestCase):
     def tearDown(self):
 
         self.patcher.stop()
+        self.issues_patcher.stop()
 
     @patch("statuspage.run_update")
     def test_create(self, run_update):
@@ -177,6 +185,82 @@ class CLITestCase(TestCase):
         self.issue1.get_comments.assert_called_once_with()
         """
 
+    def setup_update(self):
+        # mock the files on the gh-pages branch and the history of the index
+        repo = self.gh().get_user().get_repo()
+        repo.get_git_ref.return_value.object.sha = "head"
+        template_file = Mock()
+        template_file.decoded_content = (
+            b"{% for incident in incidents %}{{ incident.title }}: {{ incident.systems|join(',') }}, "
+            b"{{ incident.updates|length }} updates. {% endfor %}{{ panels }}"
+        )
+        template, index = Mock(), Mock()
+        template.path, template.sha = "template.html", statuspage.git_blob_sha(template_file.decoded_content)
+        index.path, index.sha = "index.html", "index-sha"
+        repo.get_contents.side_effect = lambda path, ref: {
+            "/": [template, index],
+            "/template.html": template_file
+        }[path]
+        repo.get_commits.return_value = []
+
+        cache_dir = tempfile.mkdtemp()
+        for patcher in (
+            patch("statuspage.CACHE_DIR", cache_dir),
+            patch("statuspage.MARKDOWN_CACHE_PATH", os.path.join(cache_dir, "markdown.json"))
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        return repo
+
+    def test_update_commits_index(self):
+        repo = self.setup_update()
+
+        runner = CliRunner()
+        result = runner.invoke(update, ["--name", "testrepo", "--token", "token"])
+        self.assertEqual(result.exit_code, 0, result.output)
+
+        self.gh().get_user().get_repo.assert_called_with(name="testrepo")
+        repo.update_file.assert_called_once()
+        kwargs = repo.update_file.call_args[1]
+        self.assertEqual(kwargs["path"], "index.html")
+        self.assertEqual(kwargs["sha"], "index-sha")
+        self.assertEqual(
+            kwargs["content"],
+            "some issue: Website, 1 updates. some issue: API, 1 updates. "
+            "{'major outage': ['API', 'Website']}"
+        )
+        self.assertIn("\n\n" + statuspage.CONTENT_TRAILER, kwargs["message"])
+
+    def test_update_skips_unchanged_page(self):
+        repo = self.setup_update()
+        runner = CliRunner()
+        runner.invoke(update, ["--name", "testrepo", "--token", "token"])
+
+        # the index has been committed with the current content
+        commit = Mock()
+        commit.sha = "head"
+        commit.commit.message = repo.update_file.call_args[1]["message"]
+        repo.get_commits.return_value = [commit]
+        repo.update_file.reset_mock()
+
+        result = runner.invoke(update, ["--name", "testrepo", "--token", "token"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("No changes since the last update", result.output)
+        repo.update_file.assert_not_called()
+
+        # the author is no longer a collaborator, the page has to change
+        repo.get_collaborators.return_value = []
+        result = runner.invoke(update, ["--name", "testrepo", "--token", "token"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(repo.update_file.call_args[1]["content"], "{'major outage': ['API', 'Website']}")
+
+        # --force re-generates the page anyway
+        repo.update_file.reset_mock()
+        repo.get_collaborators.return_value = [self.collaborator, ]
+        result = runner.invoke(update, ["--name", "testrepo", "--token", "token", "--force"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        repo.update_file.assert_called_once()
+
     def test_dont_upgrade_when_nothing_changes(self):
         runner = CliRunner()
         self.template.content = codecs.encode(b"some foo", "base64")
@@ -189,6 +273,396 @@ class CLITestCase(TestCase):
 
 class UtilTestCase(TestCase):
 
+    @patch("statuspage.Github")
+    def test_get_github_reuses_client(self, gh):
+        statuspage._GITHUB_CLIENTS.clear()
+        self.assertIs(statuspage.get_github("token"), statuspage.get_github("token"))
+        gh.assert_called_once_with("token")
+
+    def test_pooled_connection_session(self):
+        retry = statuspage.Retry(total=5)
+        connection = statuspage.PooledHTTPSConnection("api.github.com", retry=retry)
+        self.assertIs(connection.session.get_adapter("https://api.github.com").max_retries, retry)
+        # the session is shared between connections with the same retry configuration
+        self.assertIs(
+            statuspage.PooledHTTPSConnection("api.github.com", retry=retry).session,
+            connection.session
+        )
+
+        # without a retry configuration the default one is used
+        session = statuspage.PooledHTTPSConnection("api.github.com").session
+        self.assertIs(session, statuspage.get_session())
+        self.assertIs(
+            session.get_adapter("https://api.github.com").max_retries, statuspage.DEFAULT_RETRY
+        )
+
+        # credentials from ~/.netrc must not replace the token
+        self.assertIs(session.auth, statuspage.no_auth)
+
+    @patch.dict("statuspage._TOKEN_CYCLES", clear=True)
+    @patch("statuspage.Github")
+    def test_multiple_tokens(self, gh):
+        statuspage._GITHUB_CLIENTS.clear()
+        statuspage.get_github("token1, token2")
+        gh.assert_called_once_with("token1")
+
+        self.assertEqual(
+            [statuspage.next_token("token1, token2") for _ in range(3)],
+            ["token1", "token2", "token1"]
+        )
+        self.assertEqual(statuspage.next_token("token3"), "token3")
+
+        # the connection swaps in the next token for reads of the repo
+        connection = statuspage.PooledHTTPSConnection("api.github.com")
+        connection.request("GET", "/repos/some-dude/testrepo", None, {"Authorization": "token token1"})
+        with patch("statuspage.HTTPSRequestsConnectionClass.getresponse"):
+            connection.getresponse()
+        self.assertEqual(connection.headers["Authorization"], "token token2")
+
+        # but not for requests scoped to the authenticated user, or writes
+        for verb, url in (("GET", "/user"), ("PUT", "/repos/some-dude/testrepo/contents/index.html")):
+            connection.request(verb, url, None, {"Authorization": "token token1"})
+            with patch("statuspage.HTTPSRequestsConnectionClass.getresponse"):
+                connection.getresponse()
+            self.assertEqual(connection.headers["Authorization"], "token token1")
+
+    @patch.dict("statuspage._TOKEN_CYCLES", clear=True)
+    def test_multiple_tokens_of_different_users(self):
+        statuspage._GITHUB_CLIENTS.clear()
+        users = {"token token1": "user1", "token token2": "user2"}
+        sent = []
+
+        def respond(url, headers, **kwargs):
+            sent.append((url, headers["Authorization"]))
+            response = Mock()
+            response.status_code = 200
+            response.headers = {"content-type": "application/json"}
+            if url.endswith("/user"):
+                data = {"login": users[headers["Authorization"]]}
+            elif url.endswith("/labels"):
+                data = []
+            else:
+                data = {"name": "testrepo", "owner": {"login": "user1"}, "full_name": "user1/testrepo",
+                        "url": "https://api.github.com/repos/user1/testrepo"}
+            response.text = statuspage.json_dumps(data).decode("utf-8")
+            return response
+
+        session = Mock()
+        session.get.side_effect = session.post.side_effect = respond
+        with patch("statuspage.get_session", return_value=session):
+            repo = statuspage.get_repo(token="token1,token2", name="testrepo", org=False)
+            list(repo.get_labels())
+            statuspage.get_github("token1,token2").get_user().create_repo(name="testrepo")
+
+        # the user is always resolved with the first token, the repo is read with both
+        self.assertIn(("https://api.github.com:443/user", "token token1"), sent)
+        self.assertNotIn(("https://api.github.com:443/user", "token token2"), sent)
+        self.assertEqual(
+            {auth for url, auth in sent if "/repos/user1/testrepo" in url},
+            {"token token1", "token token2"}
+        )
+        self.assertIn(("https://api.github.com:443/user/repos", "token token1"), sent)
+
+    def test_get_template_change(self):
+        content = statuspage.read_template("style.css")
+
+        self.assertEqual(
+            statuspage.get_template_change("style.css", files={}),
+            (content, None)
+        )
+
+        self.assertIsNone(statuspage.get_template_change(
+            "style.css", files={"style.css": statuspage.git_blob_sha(content)}
+        ))
+
+        self.assertEqual(
+            statuspage.get_template_change("style.css", files={"style.css": "old-sha"}),
+            (content, "old-sha")
+        )
+
+    def test_git_blob_sha(self):
+        # the SHA git computes for a blob containing "hello world\n"
+        self.assertEqual(
+            statuspage.git_blob_sha("hello world\n"),
+            "3b18e512dba79e4c8300dd08aeb37f8e728b8dad"
+        )
+
+    def test_get_systems(self):
+        website = statuspage.Label(name="Website", color=DEFAULT_CONFIG['system-color'])
+        api = statuspage.Label(name="API", color=DEFAULT_CONFIG['system-color'])
+        issue = statuspage.Issue(
+            number=1,
+            title="some issue",
+            body="",
+            state="open",
+            created_at=datetime.now(),
+            updated_at=datetime.now(),
+            author="some-dude",
+            labels=[statuspage.Label(name="major outage", color="FF4D4D"), website],
+            comments=[]
+        )
+
+        systems, panels = statuspage.get_systems(
+            [website, api], [issue], DEFAULT_CONFIG['system-color'], DEFAULT_CONFIG['status-labels']
+        )
+        self.assertEqual(list(systems), ["API", "Website"])
+        self.assertEqual(systems["API"]["status"], "operational")
+        self.assertEqual(systems["Website"]["status"], "major outage")
+        self.assertEqual(panels, {"major outage": ["Website"]})
+
+    def test_is_outdated(self):
+        repo = Mock()
+        commit = Mock()
+        commit.sha = "head"
+        commit.commit.message = "update index\n\n" + statuspage.CONTENT_TRAILER + "content-hash"
+        repo.get_commits.return_value = [commit]
+
+        self.assertFalse(statuspage.is_outdated(repo, "head", "content-hash"))
+        repo.get_commits.assert_called_once_with(sha="head", path="index.html")
+
+        # the data shown on the page has changed
+        self.assertTrue(statuspage.is_outdated(repo, "head", "other-hash"))
+
+        # something else has been committed since the index was generated
+        self.assertTrue(statuspage.is_outdated(repo, "other", "content-hash"))
+
+        # the index was generated by an older version
+        commit.commit.message = "update index"
+        self.assertTrue(statuspage.is_outdated(repo, "head", "content-hash"))
+
+        # there is no index yet
+        repo.get_commits.return_value = []
+        self.assertTrue(statuspage.is_outdated(repo, "head", "content-hash"))
+
+    def test_get_content_hash(self):
+        website = statuspage.Label(name="Website", color=DEFAULT_CONFIG['system-color'])
+        issue = statuspage.Issue(
+            number=1,
+            title="some issue",
+            body="",
+            state="closed",
+            created_at=datetime(2016, 9, 6, 9),
+            updated_at=datetime(2016, 9, 6, 9),
+            author="some-dude",
+            labels=[website],
+            comments=[]
+        )
+        unlabeled_issue = issue._replace(number=2, labels=[])
+
+        def content_hash(labels, issues, collaborators):
+            systems, panels = statuspage.get_systems(
+                labels, issues, DEFAULT_CONFIG['system-color'], DEFAULT_CONFIG['status-labels']
+            )
+            incidents = statuspage.get_incidents(
+                issues, collaborators, DEFAULT_CONFIG['system-color'], DEFAULT_CONFIG['status-labels']
+            )
+            return statuspage.get_content_hash(systems, panels, incidents)
+
+        content = content_hash([website], [issue, unlabeled_issue], ["some-dude"])
+
+        # changes that don't show up on the page don't change the hash
+        self.assertEqual(content_hash(
+            [website], [issue, unlabeled_issue._replace(updated_at=datetime(2016, 9, 7))], ["some-dude"]
+        ), content)
+
+        # the author is no longer a collaborator, the incident disappears
+        self.assertNotEqual(content_hash([website], [issue, unlabeled_issue], []), content)
+
+        # a system has been renamed
+        self.assertNotEqual(content_hash(
+            [website._replace(name="Web")], [issue, unlabeled_issue], ["some-dude"]
+        ), content)
+
+    def test_get_incident(self):
+        issue = statuspage.Issue(
+            number=1,
+            title="some issue",
+            body="foo",
+            state="open",
+            created_at=datetime.now(),
+            updated_at=datetime.now(),
+            author="some-dude",
+            labels=[
+                statuspage.Label(name="major outage", color="FF4D4D"),
+                statuspage.Label(name="Website", color=DEFAULT_CONFIG['system-color'])
+            ],
+            comments=[
+                statuspage.Comment(body="bar", created_at=datetime.now(), author="some-dude"),
+                statuspage.Comment(body="baz", created_at=datetime.now(), author="some-other-dude")
+            ]
+        )
+
+        incident = statuspage.get_incident(
+            issue, ["some-dude"], DEFAULT_CONFIG['system-color'], DEFAULT_CONFIG['status-labels']
+        )
+        self.assertEqual(incident["systems"], ["Website"])
+
+        # affected systems are sorted by name
+        incident = statuspage.get_incident(
+            issue._replace(labels=issue.labels + [
+                statuspage.Label(name="API", color=DEFAULT_CONFIG['system-color'])
+            ]),
+            ["some-dude"], DEFAULT_CONFIG['system-color'], DEFAULT_CONFIG['status-labels']
+        )
+        self.assertEqual(incident["systems"], ["API", "Website"])
+        self.assertEqual(incident["severity"], "major outage")
+        # only updates by collaborators are displayed
+        self.assertEqual(len(incident["updates"]), 1)
+
+        # issues by non collaborators are not displayed
+        self.assertIsNone(statuspage.get_incident(
+            issue, ["some-other-dude"], DEFAULT_CONFIG['system-color'], DEFAULT_CONFIG['status-labels']
+        ))
+
+    def test_get_incidents_sorted_by_date(self):
+        issue = statuspage.Issue(
+            number=1,
+            title="old issue",
+            body="",
+            state="closed",
+            created_at=datetime(2016, 9, 1),
+            updated_at=datetime(2016, 9, 1),
+            author="some-dude",
+            labels=[statuspage.Label(name="Website", color=DEFAULT_CONFIG['system-color'])],
+            comments=[]
+        )
+        new_issue = issue._replace(title="new issue", created_at=datetime(2016, 9, 6))
+
+        incidents = statuspage.get_incidents(
+            [issue, new_issue], ["some-dude"], DEFAULT_CONFIG['system-color'],
+            DEFAULT_CONFIG['status-labels']
+        )
+        self.assertEqual([i["title"] for i in incidents], ["new issue", "old issue"])
+
+    @patch("statuspage.get_session")
+    def test_graphql(self, get_session):
+        response = get_session().post.return_value
+        response.status_code = 200
+        response.content = b'{"data": {"viewer": {"login": "some-dude"}}}'
+        self.assertEqual(
+            statuspage.graphql("token", "query { viewer { login } }"),
+            {"viewer": {"login": "some-dude"}}
+        )
+        self.assertEqual(get_session().post.call_args[1]["timeout"], statuspage.DEFAULT_TIMEOUT)
+
+        # errors in the response body
+        response.content = b'{"data": null, "errors": [{"message": "foo"}]}'
+        with self.assertRaises(GithubException):
+            statuspage.graphql("token", "query { viewer { login } }")
+
+        # error responses are not necessarily JSON
+        response.status_code = 502
+        response.content = response.text = "<html>Bad Gateway</html>"
+        with self.assertRaises(GithubException) as e:
+            statuspage.graphql("token", "query { viewer { login } }")
+        self.assertEqual(e.exception.status, 502)
+
+    @patch("statuspage.graphql")
+    def test_get_issues(self, graphql):
+        repo = Mock()
+        repo.owner.login = "some-dude"
+        repo.name = "testrepo"
+
+        def comment(body):
+            return {"body": body, "createdAt": "2016-09-06T10:00:00Z", "author": {"login": "some-dude"}}
+
+        graphql.side_effect = [
+            {"repository": {"issues": {
+                "pageInfo": {"hasNextPage": False, "endCursor": "issues"},
+                "nodes": [{
+                    "number": 1,
+                    "title": "some issue",
+                    "body": "some body",
+                    "state": "CLOSED",
+                    "createdAt": "2016-09-06T09:00:00Z",
+                    "updatedAt": "2016-09-06T10:00:00Z",
+                    "author": None,
+                    "labels": {"nodes": [{"name": "Website", "color": "171717"}]},
+                    "comments": {
+                        "pageInfo": {"hasNextPage": True, "endCursor": "comments"},
+                        "nodes": [comment("first")]
+                    }
+                }]
+            }}},
+            {"repository": {"issue": {"comments": {
+                "pageInfo": {"hasNextPage": False, "endCursor": None},
+                "nodes": [comment("second")]
+            }}}},
+        ]
+
+        issue, = statuspage.get_issues("token", repo)
+        self.assertEqual(issue.state, "closed")
+        self.assertEqual(issue.created_at, datetime(2016, 9, 6, 9))
+        self.assertIsNone(issue.author)
+        self.assertEqual(issue.labels, [statuspage.Label(name="Website", color="171717")])
+        self.assertEqual([c.body for c in issue.comments], ["first", "second"])
+        self.assertEqual(graphql.call_args[1]["cursor"], "comments")
+
+    def test_render_markdown(self):
+        cache = {}
+        html = statuspage.render_markdown("*foo*", cache=cache)
+        self.assertEqual(html, statuspage.render_markdown("*foo*"))
+        self.assertEqual(list(cache.values()), [html])
+
+        # cached texts are not rendered again
+        with patch("statuspage.markdown2.markdown") as markdown:
+            self.assertEqual(statuspage.render_markdown("*foo*", cache=cache), html)
+            markdown.assert_not_called()
+
+    def test_markdown_cache(self):
+        path = os.path.join(tempfile.mkdtemp(), "statuspage", "markdown.json")
+        with patch("statuspage.MARKDOWN_CACHE_PATH", path), patch("statuspage.MARKDOWN_CACHE_SIZE", 2):
+            self.assertEqual(statuspage.read_markdown_cache(), {})
+
+            # a corrupted cache is ignored
+            for content in (b"not json", b"1", b"[1]"):
+                statuspage.write_cache_file(path, content)
+                self.assertEqual(statuspage.read_markdown_cache(), {})
+
+            statuspage.write_markdown_cache({"a": "1", "c": "3", "b": "2"})
+            # only the most recently used entries are kept, in order
+            self.assertEqual(
+                list(statuspage.read_markdown_cache().items()),
+                [("c", "3"), ("b", "2")]
+            )
+
+    def test_read_local_config(self):
+        path = os.path.join(tempfile.mkdtemp(), "my-config.json")
+        with open(path, "wb") as f:
+            f.write(statuspage.json_dumps({"title": "My Status"}))
+
+        self.assertEqual(statuspage.read_local_config(path), {"title": "My Status"})
+
+        with self.assertRaises(click.FileError):
+            statuspage.read_local_config(path + ".missing")
+
+    def test_get_template(self):
+        repo = Mock()
+        source = b"{{ config.title }}"
+        sha = statuspage.git_blob_sha(source)
+        repo.get_contents.return_value.decoded_content = source
+
+        with patch("statuspage.CACHE_DIR", tempfile.mkdtemp()):
+            template = statuspage.get_template(repo, sha, ref="head")
+            self.assertEqual(template.render(config={"title": "Status"}), "Status")
+            self.assertIs(statuspage.get_template(repo, sha, ref="head"), template)
+            repo.get_contents.assert_called_once_with(path="/template.html", ref="head")
+
+            # the source is read from the local cache in the next run
+            statuspage._TEMPLATE_SOURCES.clear()
+            repo.get_contents.reset_mock()
+            statuspage.get_template(repo, sha, ref="head")
+            repo.get_contents.assert_not_called()
+
+    def test_json(self):
+        dumped = statuspage.json_dumps(DEFAULT_CONFIG)
+        self.assertEqual(statuspage.json_loads(dumped), DEFAULT_CONFIG)
+
+        # the stdlib fallback produces the same output
+        with patch("statuspage.orjson", None):
+            self.assertEqual(statuspage.json_dumps(DEFAULT_CONFIG), dumped)
+            self.assertEqual(statuspage.json_loads(dumped), DEFAULT_CONFIG)
+
     def test_iter_systems(self):
         label1 = Mock()
         label2 = Mock()